@@ -0,0 +1,384 @@
+import os
+import time
+import uuid
+import random
+import sqlite3
+import logging
+import threading
+from datetime import date
+from contextlib import contextmanager
+from typing import Optional, List, Dict
+
+# Configure Logging
+logger = logging.getLogger(__name__)
+
+# Timeout for a single lease store call: the SQLite busy timeout or the Redis socket timeouts.
+# Kept well under TIME_RESERVE_SECONDS in lambda_function.py so a slow store cannot eat the Lambda timeout
+LEASE_STORE_TIMEOUT_SECONDS = 1.0
+
+# How long the end of a lease waits for a renewal that is still talking to the store
+RENEWER_JOIN_TIMEOUT_SECONDS = 1.0
+
+# Lua script used by the Redis lease store so that expiring, counting and
+# granting a lease happen as one atomic step on the Redis server
+REDIS_ACQUIRE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[4])
+    return 1
+end
+return 0
+"""
+
+
+class ConnectionBudgetExhausted(Exception):
+    """Raised when no DB connection lease could be obtained within the wait time."""
+
+
+class SQLiteLeaseStore:
+    """
+    Lease store backed by a SQLite file. Used locally and in load tests as a
+    stand-in for a shared store; every process pointing at the same file shares
+    the same connection budget.
+
+    Args:
+    path (str): Path of the SQLite file holding the leases.
+    ttl (float): Seconds after which a lease that is neither renewed nor released expires.
+    busy_timeout (float): Seconds to wait for another process holding the SQLite write lock.
+    """
+
+    def __init__(self, path, ttl, busy_timeout=LEASE_STORE_TIMEOUT_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        self.busy_timeout = busy_timeout
+        conn = self._connect()
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS leases (lease_id TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+
+    def try_acquire(self, budget) -> Optional[str]:
+        """
+        Grants a lease if fewer than budget leases are active.
+
+        Returns:
+        str: The lease id, or None when the budget is exhausted.
+        """
+        now = time.time()
+        lease_id = uuid.uuid4().hex
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE takes the write lock so that the count and the insert cannot interleave
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+            except sqlite3.OperationalError as e:
+                # Another process held the lock past the busy timeout; treated like a full budget so the caller backs off
+                logger.info(f"Lease store busy: {e}")
+                return None
+            conn.execute("DELETE FROM leases WHERE expires_at <= ?", (now,))
+            (active,) = conn.execute("SELECT COUNT(*) FROM leases").fetchone()
+            if active >= budget:
+                conn.execute("COMMIT")
+                return None
+            conn.execute("INSERT INTO leases (lease_id, expires_at) VALUES (?, ?)", (lease_id, now + self.ttl))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return lease_id
+
+    def release(self, lease_id):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM leases WHERE lease_id = ?", (lease_id,))
+        finally:
+            conn.close()
+
+    def renew(self, lease_id) -> bool:
+        """
+        Pushes the expiry of a held lease ttl seconds into the future.
+
+        Returns:
+        bool: False if the lease had already expired and been reclaimed.
+        """
+        conn = self._connect()
+        try:
+            renewed = conn.execute("UPDATE leases SET expires_at = ? WHERE lease_id = ?", (time.time() + self.ttl, lease_id)).rowcount > 0
+        finally:
+            conn.close()
+        return renewed
+
+    def active(self) -> int:
+        conn = self._connect()
+        try:
+            (active,) = conn.execute("SELECT COUNT(*) FROM leases WHERE expires_at > ?", (time.time(),)).fetchone()
+        finally:
+            conn.close()
+        return active
+
+
+class RedisLeaseStore:
+    """
+    Lease store backed by Redis (e.g. ElastiCache) so that all Lambda containers
+    share one connection budget. Leases are kept in a sorted set scored by their expiry time.
+
+    Args:
+    url (str): Redis url, e.g. redis://host:6379/0
+    ttl (float): Seconds after which a lease that is neither renewed nor released expires.
+    key (str): Name of the sorted set holding the leases.
+    timeout (float): Socket connect & read timeout for every Redis call.
+    client (redis.Redis): Client to use instead of connecting to url, e.g. a fakeredis client in tests.
+    """
+
+    def __init__(self, url, ttl, key="superstore:db_leases", timeout=LEASE_STORE_TIMEOUT_SECONDS, client=None):
+        # redis is only needed when this store is configured so it is not packaged by default
+        import redis
+        self.errors = redis.RedisError
+        self.client = client or redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self.ttl = ttl
+        self.key = key
+        self._acquire = self.client.register_script(REDIS_ACQUIRE_SCRIPT)
+
+    def try_acquire(self, budget) -> Optional[str]:
+        """
+        Grants a lease if fewer than budget leases are active.
+
+        Returns:
+        str: The lease id, or None when the budget is exhausted or Redis is unreachable.
+        """
+        now = time.time()
+        lease_id = uuid.uuid4().hex
+        try:
+            granted = self._acquire(keys=[self.key], args=[now, budget, now + self.ttl, lease_id])
+        except self.errors as e:
+            # e.g. an ElastiCache failover; treated like a full budget so the caller backs off & falls back to the name cache
+            logger.error(f"Lease store unavailable: {e}")
+            return None
+        return lease_id if granted else None
+
+    def release(self, lease_id):
+        self.client.zrem(self.key, lease_id)
+
+    def renew(self, lease_id) -> bool:
+        # XX only updates an existing member so an expired and reclaimed lease is not re-added
+        return bool(self.client.zadd(self.key, {lease_id: time.time() + self.ttl}, xx=True, ch=True))
+
+    def active(self) -> int:
+        return self.client.zcount(self.key, time.time(), "+inf")
+
+
+def lease_store_from_url(url, ttl, timeout=LEASE_STORE_TIMEOUT_SECONDS):
+    """
+    Builds the lease store for the given url.
+
+    Args:
+    url (str): sqlite:///<path> or redis://<host>:<port>/<db>
+    ttl (float): Seconds after which a lease that is neither renewed nor released expires.
+    timeout (float): Timeout for a single call to the store.
+
+    Returns:
+    SQLiteLeaseStore or RedisLeaseStore
+    """
+    if url.startswith("sqlite:///"):
+        return SQLiteLeaseStore(url[len("sqlite:///"):], ttl, busy_timeout=timeout)
+    if url.startswith(("redis://", "rediss://")):
+        return RedisLeaseStore(url, ttl, timeout=timeout)
+    raise ValueError(f"Unsupported lease store url: {url}")
+
+
+class ConnectionGovernor:
+    """
+    Admits DB connections against a global concurrency budget. A caller that
+    finds the budget used up retries with exponential backoff and jitter until
+    wait_seconds have passed, then gets ConnectionBudgetExhausted. While a
+    lease is held it is renewed every third of the store's ttl, so a connection
+    held longer than the ttl keeps its lease; the ttl only reclaims the leases
+    of invocations that died without releasing them.
+
+    Args:
+    store (SQLiteLeaseStore or RedisLeaseStore): Shared lease store; unused when budget is 0.
+    budget (int): Maximum number of concurrent DB connections; 0 disables the governor.
+    wait_seconds (float): How long to keep retrying for a lease.
+    backoff_seconds (float): First retry delay; doubled after every failed attempt.
+    max_backoff_seconds (float): Upper limit for the retry delay.
+    """
+
+    def __init__(self, store, budget, wait_seconds=5.0, backoff_seconds=0.05, max_backoff_seconds=1.0):
+        self.store = store
+        self.budget = budget
+        self.wait_seconds = wait_seconds
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+
+    def acquire(self, wait_seconds=None) -> str:
+        wait_seconds = self.wait_seconds if wait_seconds is None else wait_seconds
+        deadline = time.monotonic() + wait_seconds
+        delay = self.backoff_seconds
+        while True:
+            lease_id = self.store.try_acquire(self.budget)
+            if lease_id is not None:
+                return lease_id
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ConnectionBudgetExhausted(f"No DB connection lease available within {wait_seconds:.2f}s (budget {self.budget})")
+            logger.info(f"DB connection budget of {self.budget} exhausted; retrying in {delay:.2f}s")
+            time.sleep(min(random.uniform(0, delay), remaining))
+            delay = min(delay * 2, self.max_backoff_seconds)
+
+    def release(self, lease_id):
+        try:
+            self.store.release(lease_id)
+        except Exception as e:
+            # The lease expires after its ttl anyway so a failed release must not fail the invocation
+            logger.error(f"Could not release DB connection lease {lease_id}: {e}")
+
+    def _renew(self, lease_id, stop):
+        while not stop.wait(self.store.ttl / 3):
+            try:
+                if not self.store.renew(lease_id):
+                    logger.error(f"DB connection lease {lease_id} expired before it was renewed; the budget may be exceeded")
+            except Exception as e:
+                logger.error(f"Could not renew DB connection lease {lease_id}: {e}")
+
+    @contextmanager
+    def lease(self, wait_seconds=None):
+        """
+        Holds a connection lease for the duration of the with block.
+
+        Args:
+        wait_seconds (float): Overrides the governor's wait_seconds for this lease.
+
+        Raises:
+        ConnectionBudgetExhausted: When no lease was obtained within the wait time.
+        """
+        if self.budget <= 0:
+            yield None
+            return
+        lease_id = self.acquire(wait_seconds)
+        stop = threading.Event()
+        renewer = threading.Thread(target=self._renew, args=(lease_id, stop), daemon=True)
+        renewer.start()
+        try:
+            yield lease_id
+        finally:
+            stop.set()
+            # Bounded so that a renewal stuck on the store cannot hold up an invocation whose query is done
+            renewer.join(timeout=RENEWER_JOIN_TIMEOUT_SECONDS)
+            self.release(lease_id)
+
+
+def governor_from_env() -> ConnectionGovernor:
+    """
+    Builds the connection governor from the environment variables:
+    DB_CONNECTION_BUDGET (0 or unset disables the governor), LEASE_STORE_URL,
+    LEASE_STORE_TIMEOUT_SECONDS, LEASE_TTL_SECONDS, LEASE_WAIT_SECONDS and LEASE_BACKOFF_SECONDS.
+
+    The budget is only global if every invocation uses the same store, so a
+    budget without LEASE_STORE_URL, or a SQLite store inside Lambda (where /tmp
+    is private to one container), is rejected.
+
+    Returns:
+    ConnectionGovernor: Governor shared by all DB access in the process.
+
+    Raises:
+    ValueError: When the budget is set without a shared lease store.
+    """
+    budget = int(os.getenv('DB_CONNECTION_BUDGET') or 0)
+    ttl = float(os.getenv('LEASE_TTL_SECONDS') or 30)
+    store_url = os.getenv('LEASE_STORE_URL')
+    store = None
+    if budget > 0:
+        if not store_url:
+            raise ValueError("DB_CONNECTION_BUDGET is set but LEASE_STORE_URL is not; the budget needs a store shared by all invocations")
+        if store_url.startswith("sqlite:///") and os.getenv('AWS_LAMBDA_FUNCTION_NAME'):
+            raise ValueError("A SQLite lease store is private to one Lambda container; use a redis:// LEASE_STORE_URL for a global budget")
+        store = lease_store_from_url(store_url, ttl, timeout=float(os.getenv('LEASE_STORE_TIMEOUT_SECONDS') or LEASE_STORE_TIMEOUT_SECONDS))
+    return ConnectionGovernor(
+        store,
+        budget,
+        wait_seconds=float(os.getenv('LEASE_WAIT_SECONDS') or 5),
+        backoff_seconds=float(os.getenv('LEASE_BACKOFF_SECONDS') or 0.05),
+    )
+
+
+def parse_ids(ids_str) -> List[str]:
+    """
+    Splits the "(id1, id2, ...)" string built by extract_ids into a list of ids.
+    """
+    return [x.strip() for x in ids_str.strip("()").split(",") if x.strip()]
+
+
+class NameCache:
+    """
+    Customer names returned by earlier queries. Kept at module level so that it
+    survives between invocations of a warm Lambda container and can answer a
+    request when the connection budget is exhausted.
+
+    Args:
+    max_size (int): Maximum number of customers kept; the oldest entries are dropped first.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.names: Dict[str, tuple] = {}
+
+    def update(self, result):
+        for row in result:
+            self.names.pop(str(row["id"]), None)
+            self.names[str(row["id"])] = (row["id"], row["name"])
+        while len(self.names) > self.max_size:
+            self.names.pop(next(iter(self.names)))
+
+    def lookup(self, ids) -> Optional[List[dict]]:
+        """
+        Returns the rows for the given ids in the same shape as extract_names_db,
+        or None if any of the ids is not cached.
+        """
+        if not all(str(x) in self.names for x in ids):
+            return None
+        today = str(date.today())
+        rows = sorted({self.names[str(x)] for x in ids})
+        return [{"id": r[0], "name": r[1], "date": today} for r in rows]
+
+
+def fetch_names(governor, name_cache, connect, disconnect, extract_names, ids_str, wait_seconds=None):
+    """
+    Extracts the customer names while holding a lease from the connection governor.
+    When no lease is available within the wait time the names are served from the name cache.
+
+    Args:
+    governor (ConnectionGovernor): Governor admitting the DB connection.
+    name_cache (NameCache): Cache updated with every DB result and used as the fallback.
+    connect (callable): Returns a DB engine, or None if no connection could be established.
+    disconnect (callable): Disposes the engine returned by connect.
+    extract_names (callable): extract_names_db(engine, ids_str) of the calling module.
+    ids_str (str): A string of customer ids as returned by extract_ids
+    wait_seconds (float): Overrides the governor's wait time, e.g. to stay within the Lambda timeout.
+
+    Returns:
+    list: Customer id, name and date for each id, or None on a DB failure
+
+    Raises:
+    ConnectionBudgetExhausted: When the budget is exhausted and not all ids are cached.
+    """
+    try:
+        with governor.lease(wait_seconds):
+            engine = connect()
+            if engine is None:
+                logger.error("ERROR: Could not establish DB connection")
+                return None
+            try:
+                result = extract_names(engine, ids_str)
+            finally:
+                disconnect(engine)
+    except ConnectionBudgetExhausted as e:
+        result = name_cache.lookup(parse_ids(ids_str))
+        if result is None:
+            raise ConnectionBudgetExhausted(f"{e}; not all customer ids are in the name cache") from e
+        logger.warning(f"{e}; served names from the cache")
+        return result
+    if result is not None:
+        name_cache.update(result)
+    return result
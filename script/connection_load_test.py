@@ -0,0 +1,131 @@
+"""
+Load test for the connection governor.
+
+Simulates N Lambda handlers hitting a local MySQL at the same time and reports
+the outcome of each handler along with the latency percentiles. Every handler
+runs in its own process with its own governor, like separate Lambda containers,
+so the budget is only enforced through the shared lease store.
+
+Start a local MySQL with a low connection cap, e.g.
+    docker run -d --name mysql-cap -e MYSQL_ROOT_PASSWORD=root -p 3307:3306 mysql:8 --max-connections=10
+
+Then run (from the project folder):
+    python script/connection_load_test.py --handlers 100 --budget 8 --port 3307 --user root --password root
+    python script/connection_load_test.py --handlers 100 --budget 0 --port 3307 --user root --password root   # no governor
+"""
+import os
+import time
+import argparse
+import tempfile
+import queue
+import multiprocessing
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+from connection_governor import ConnectionBudgetExhausted, ConnectionGovernor, lease_store_from_url
+
+# Seconds the handlers wait for each other at the start line
+BARRIER_TIMEOUT_SECONDS = 60
+
+
+def simulated_handler(args, store_url, barrier, results):
+    """
+    Runs the DB part of one lambda_handler invocation: take a lease, open an
+    engine, run a query that holds the connection for args.hold seconds and dispose the engine.
+    Always puts an outcome on results so that main never waits for a handler that failed.
+    """
+    connection_string = f"mysql+mysqlconnector://{args.user}:{args.password}@{args.host}:{args.port}/{args.database}"
+    start = time.perf_counter()
+    try:
+        governor = ConnectionGovernor(lease_store_from_url(store_url, ttl=30), args.budget, wait_seconds=args.wait)
+    except Exception:
+        # e.g. the SQLite file was locked while all handlers created the table
+        governor = None
+    try:
+        # A handler that failed its setup still reaches the start line so the others are not left waiting
+        barrier.wait()
+    except Exception:
+        # The start line timed out
+        governor = None
+    if governor is None:
+        results.put(("setup_error", time.perf_counter() - start))
+        return
+    start = time.perf_counter()
+    try:
+        with governor.lease():
+            engine = create_engine(connection_string, poolclass=NullPool)
+            try:
+                with engine.connect() as conn:
+                    conn.execute(text("SELECT SLEEP(:hold)"), {"hold": args.hold})
+            finally:
+                engine.dispose()
+        outcome = "ok"
+    except ConnectionBudgetExhausted:
+        # lambda_handler would serve these from the name cache
+        outcome = "budget_exhausted"
+    except Exception:
+        # e.g. MySQL error 1040: Too many connections
+        outcome = "db_error"
+    results.put((outcome, time.perf_counter() - start))
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of values."""
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent Lambda handlers against a local MySQL")
+    parser.add_argument("--handlers", type=int, default=50, help="Number of concurrent handlers")
+    parser.add_argument("--budget", type=int, default=8, help="Connection budget; 0 disables the governor")
+    parser.add_argument("--hold", type=float, default=0.5, help="Seconds each handler holds its connection")
+    parser.add_argument("--wait", type=float, default=10.0, help="Seconds a handler waits for a lease")
+    parser.add_argument("--store", default=None, help="Lease store url; defaults to a temporary SQLite file")
+    parser.add_argument("--host", default=os.getenv('HOST_MYSQL') or "127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv('PORT') or 3306))
+    parser.add_argument("--user", default=os.getenv('USER_MYSQL') or "root")
+    parser.add_argument("--password", default=os.getenv('PASSWORD') or "")
+    parser.add_argument("--database", default="mysql")
+    args = parser.parse_args()
+    if args.handlers < 1:
+        parser.error("--handlers must be at least 1")
+
+    store_url = args.store or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'leases.sqlite')}"
+    store = lease_store_from_url(store_url, ttl=30)
+
+    barrier = multiprocessing.Barrier(args.handlers, timeout=BARRIER_TIMEOUT_SECONDS)
+    result_queue = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=simulated_handler, args=(args, store_url, barrier, result_queue)) for _ in range(args.handlers)]
+    for w in workers:
+        w.start()
+    # A handler can take the start line wait, the lease wait & the query; one that never reports counts as hung
+    result_timeout = BARRIER_TIMEOUT_SECONDS + args.wait + args.hold + 30
+    results = []
+    for _ in workers:
+        try:
+            results.append(result_queue.get(timeout=result_timeout))
+        except queue.Empty:
+            break
+    hung = len(workers) - len(results)
+    for w in workers:
+        w.join(timeout=1)
+        if w.is_alive():
+            w.terminate()
+
+    latencies = [latency for outcome, latency in results if outcome != "setup_error"]
+    print(f"handlers={args.handlers} budget={args.budget} hold={args.hold}s store={store_url}")
+    for outcome in ("ok", "budget_exhausted", "db_error", "setup_error"):
+        print(f"{outcome:>17}: {sum(1 for o, _ in results if o == outcome)}")
+    print(f"{'hung':>17}: {hung}")
+    if not latencies:
+        return
+    for pct in (50, 95, 99):
+        print(f"{'p' + str(pct):>17}: {percentile(latencies, pct) * 1000:.0f} ms")
+    print(f"{'max':>17}: {max(latencies) * 1000:.0f} ms")
+    # Should be 0; anything else is a lease that was not released
+    print(f"{'leases left':>17}: {store.active()}")
+
+
+if __name__ == "__main__":
+    main()
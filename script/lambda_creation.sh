@@ -1,6 +1,8 @@
 # Goto the folder with the python virtual env for the lambda function
 cd /home/ubuntu/DataEngineering_SuperStore_Data_ETL_Pipeline/script
 thisfolder=$(pwd)
+# Install the redis client used by connection_governor.py for the shared lease store (ElastiCache)
+pip install redis -t $thisfolder/.venv/lib/python3.12/site-packages
 # Goto the path with the dependencies
 cd $thisfolder/.venv/lib/python3.12/site-packages
 # Zip the dependencies into a zip file called superstore.zip and save in the script folder
@@ -16,6 +18,8 @@ zip -d superstore.zip 'setuptools/*'
 
 # Add the lambda_function to the .zip file
 zip -g superstore.zip lambda_function.py
+# Add the connection governor used by lambda_function.py to the .zip file
+zip -g superstore.zip connection_governor.py
 # Add the script/.env file with environment variables to the .zip file
 zip -g superstore.zip .env
 # check the contents of the zip file as follows
@@ -46,15 +50,30 @@ aws iam create-role --role-name superstore_lambda_role --assume-role-policy-docu
 aws iam attach-role-policy --role-name superstore_lambda_role --policy-arn arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole
 # Policy 2
 aws iam attach-role-policy --role-name superstore_lambda_role --policy-arn arn:aws:iam::aws:policy/AmazonS3FullAccess
+# Policy 3: lets the function run inside the VPC to reach the ElastiCache lease store
+aws iam attach-role-policy --role-name superstore_lambda_role --policy-arn arn:aws:iam::aws:policy/service-role/AWSLambdaVPCAccessExecutionRole
 
 # Create the lambda function
 cd script
-aws lambda create-function --function-name superstore --zip-file fileb://superstore.zip --handler lambda_function.lambda_handler --runtime python3.12 --role arn:aws:iam::209479284263:role/superstore_lambda_role
+# --timeout must stay above LEASE_WAIT_SECONDS + the query & API post (TIME_RESERVE_SECONDS in lambda_function.py) and at most LEASE_TTL_SECONDS is reclaimed after a crash
+aws lambda create-function --function-name superstore --zip-file fileb://superstore.zip --handler lambda_function.lambda_handler --runtime python3.12 --timeout 30 --role arn:aws:iam::209479284263:role/superstore_lambda_role
 # Got size error so removed unnecessary packages; look at project creation for details
 
 # created function in the wrong region
 # aws lambda delete-function --function-name superstore
 
+# Connection governor: Redis lease store on ElastiCache shared by all invocations
+# Use the subnets & security group of the VPC that RDS is in; the security group must allow port 6379 (Redis) & 3306 (RDS)
+aws elasticache create-cache-subnet-group --cache-subnet-group-name superstore-leases --cache-subnet-group-description "superstore lease store" --subnet-ids subnet-xxxxxxxx subnet-yyyyyyyy
+aws elasticache create-cache-cluster --cache-cluster-id superstore-leases --engine redis --cache-node-type cache.t3.micro --num-cache-nodes 1 --cache-subnet-group-name superstore-leases --security-group-ids sg-xxxxxxxx
+# make a note of the endpoint address and add the following to script/.env, then re-add .env to the .zip file
+# DB_CONNECTION_BUDGET=<below RDS max_connections>
+# LEASE_STORE_URL=redis://<endpoint address>:6379/0
+aws elasticache describe-cache-clusters --cache-cluster-id superstore-leases --show-cache-node-info
+# Attach the function to the same VPC
+# NOTE: inside a VPC the function needs an S3 gateway endpoint to read the bucket & a NAT gateway to post to the API
+aws lambda update-function-configuration --function-name superstore --vpc-config SubnetIds=subnet-xxxxxxxx,subnet-yyyyyyyy,SecurityGroupIds=sg-xxxxxxxx
+
 # bucket name : wcd-week3-lambda-miniproject
 # folder with data: `input`
 # Set the permission for Lambda to explicitly allow s3 to access the bucket
@@ -75,8 +94,9 @@ aws s3api put-bucket-notification-configuration --bucket wcd-week3-lambda-minipr
 
 # test the function on the aws console
 # if errors in code; fix the errors locally
-# add updated lambd_function.py to .zip file
+# add updated lambd_function.py & connection_governor.py to .zip file
 zip -g superstore.zip lambda_function.py
+zip -g superstore.zip connection_governor.py
 # update the function on aws
 aws lambda update-function-code --function-name superstore --zip-file fileb://superstore.zip
 
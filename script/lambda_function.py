@@ -8,6 +8,7 @@ from dotenv import load_dotenv
 import boto3
 from typing import Tuple, Optional
 from urllib.parse import unquote_plus
+from connection_governor import ConnectionBudgetExhausted, NameCache, governor_from_env, fetch_names
 
 load_dotenv()
 # Load environment variables
@@ -28,6 +29,13 @@ logger.setLevel(logging.INFO)
 # we have already givem Lambda IAM permission to access s3 bucket so we do not need to give access keys
 s3_client = boto3.client('s3')
 
+# Created outside the handler so that they are reused by warm invocations of the same container
+# The governor keeps the concurrent invocations within the RDS connection limit (DB_CONNECTION_BUDGET)
+governor = governor_from_env()
+name_cache = NameCache()
+# Seconds of the Lambda timeout kept free for the query & the API post after waiting for a lease
+TIME_RESERVE_SECONDS = 10
+
 
 def connect_db():
     """
@@ -131,18 +139,19 @@ def lambda_handler(event, context):
         logger.error("Failed to extract customer IDs from JSON file.")
         return
 
-    engine = connect_db()
-    if engine is not None:
-        result = extract_names_db(engine, ids_str)
-        disconnect_db(engine)
-        
-        if result is not None:
-            response = post_api(result, URL)
-            if response.status_code == 201:
-                logger.info("SUCCESS: Data posted to API")
-            else:
-                logger.error(f"Request failed: {response.status_code} - {response.text}")
+    # Never wait for a lease past the point where the query & post can still finish within the Lambda timeout
+    wait_seconds = max(0, min(governor.wait_seconds, context.get_remaining_time_in_millis() / 1000 - TIME_RESERVE_SECONDS))
+    try:
+        result = fetch_names(governor, name_cache, connect_db, disconnect_db, extract_names_db, ids_str, wait_seconds)
+    except ConnectionBudgetExhausted as e:
+        logger.error(f"ERROR: DB connection budget exhausted: {e}")
+        return
+
+    if result is not None:
+        response = post_api(result, URL)
+        if response.status_code == 201:
+            logger.info("SUCCESS: Data posted to API")
         else:
-            logger.error("ERROR: Could not extract names from the DB")
+            logger.error(f"Request failed: {response.status_code} - {response.text}")
     else:
-        logger.error("ERROR: Could not establish DB connection")
\ No newline at end of file
+        logger.error("ERROR: Could not extract names from the DB")
\ No newline at end of file
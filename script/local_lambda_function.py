@@ -8,6 +8,7 @@ from sqlalchemy import text
 import requests
 from dotenv import load_dotenv
 from aws_utils.aws_utils import connect_to_s3, connect_db, disconnect_db
+from connection_governor import ConnectionBudgetExhausted, NameCache, governor_from_env, fetch_names
 
 load_dotenv()
 # Load environment variables
@@ -29,6 +30,10 @@ logging.basicConfig(
                     filename=LOG_FILE,
                    )
 
+# Same connection governor & name cache as lambda_function.py
+governor = governor_from_env()
+name_cache = NameCache()
+
 
 def extract_ids(bucket_name, file_path_s3):
     """
@@ -100,23 +105,23 @@ def main():
     # Download json from s3 & extract the customer ids from the file
     ids_str = extract_ids(bucket_name, file_path_s3)
     
-    engine = connect_db(db_name, USER, PASSWORD, HOST_MYSQL)
-    if engine is not None:
-        result = extract_names_db(engine, ids_str)
-        disconnect_db(engine)
-        if result is not None:
-            response = post_api(result, url)
-            if response.status_code == 201:
-                logging.info(f"Data posted to the API: {result}")
-                logging.info("Request successful: data posted!")
-                logging.info("SUCCESS: Code executed successfully to post data to API; TERMINATING code")
-            else:
-                logging.error(f"Request failed with status code {response.status_code}")
-                logging.error(response.text)
+    try:
+        result = fetch_names(governor, name_cache, lambda: connect_db(db_name, USER, PASSWORD, HOST_MYSQL), disconnect_db, extract_names_db, ids_str)
+    except ConnectionBudgetExhausted as e:
+        logging.error(f"ERROR: DB connection budget exhausted: {e}; TERMINATING code")
+        return
+
+    if result is not None:
+        response = post_api(result, url)
+        if response.status_code == 201:
+            logging.info(f"Data posted to the API: {result}")
+            logging.info("Request successful: data posted!")
+            logging.info("SUCCESS: Code executed successfully to post data to API; TERMINATING code")
         else:
-            logging.error("ERROR: Could not extract names for the DB; TERMINATING code")
+            logging.error(f"Request failed with status code {response.status_code}")
+            logging.error(response.text)
     else:
-        logging.error("ERROR: Could not establish DB connection; TERMINATING code")
+        logging.error("ERROR: Could not extract names for the DB; TERMINATING code")
 
 
 
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The lambda modules import connection_governor from the script folder, so do the tests
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "script"))
@@ -0,0 +1,264 @@
+import time
+import threading
+import multiprocessing
+import pytest
+from connection_governor import (
+    ConnectionBudgetExhausted,
+    ConnectionGovernor,
+    NameCache,
+    RedisLeaseStore,
+    SQLiteLeaseStore,
+    fetch_names,
+    governor_from_env,
+)
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / "leases.sqlite")
+
+
+def max_overlap(intervals):
+    """Largest number of (start, end) intervals open at the same time."""
+    events = sorted([(start, 1) for start, _ in intervals] + [(end, -1) for _, end in intervals])
+    current = peak = 0
+    for _, step in events:
+        current += step
+        peak = max(peak, current)
+    return peak
+
+
+def hold_lease(store_path, budget, hold, queue):
+    governor = ConnectionGovernor(SQLiteLeaseStore(store_path, ttl=30), budget, wait_seconds=30, backoff_seconds=0.01)
+    with governor.lease():
+        start = time.time()
+        time.sleep(hold)
+        end = time.time()
+    queue.put((start, end))
+
+
+def test_budget_is_never_exceeded_across_threads(store_path):
+    governor = ConnectionGovernor(SQLiteLeaseStore(store_path, ttl=30), 3, wait_seconds=30, backoff_seconds=0.01)
+    intervals = []
+    lock = threading.Lock()
+
+    def handler():
+        with governor.lease():
+            start = time.time()
+            time.sleep(0.05)
+            end = time.time()
+        with lock:
+            intervals.append((start, end))
+
+    threads = [threading.Thread(target=handler) for _ in range(30)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(intervals) == 30
+    assert max_overlap(intervals) == 3
+    assert governor.store.active() == 0
+
+
+def test_budget_is_never_exceeded_across_processes(store_path):
+    SQLiteLeaseStore(store_path, ttl=30)
+    queue = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=hold_lease, args=(store_path, 2, 0.1, queue)) for _ in range(8)]
+    for w in workers:
+        w.start()
+    intervals = [queue.get(timeout=30) for _ in workers]
+    for w in workers:
+        w.join()
+
+    assert max_overlap(intervals) <= 2
+    assert SQLiteLeaseStore(store_path, ttl=30).active() == 0
+
+
+def test_lease_is_released_when_body_raises(store_path):
+    governor = ConnectionGovernor(SQLiteLeaseStore(store_path, ttl=30), 1, wait_seconds=0)
+    with pytest.raises(RuntimeError):
+        with governor.lease():
+            raise RuntimeError("query failed")
+
+    assert governor.store.active() == 0
+    with governor.lease() as lease_id:
+        assert lease_id is not None
+
+
+def test_expired_leases_are_reclaimed(store_path):
+    store = SQLiteLeaseStore(store_path, ttl=0.1)
+    # Acquired directly on the store, so never renewed nor released, like a crashed invocation
+    assert store.try_acquire(1) is not None
+    assert store.try_acquire(1) is None
+    time.sleep(0.2)
+    assert store.try_acquire(1) is not None
+
+
+def test_held_lease_is_renewed_past_ttl(store_path):
+    governor = ConnectionGovernor(SQLiteLeaseStore(store_path, ttl=0.3), 1, wait_seconds=0)
+    with governor.lease():
+        time.sleep(0.6)
+        assert governor.store.try_acquire(1) is None
+    assert governor.store.active() == 0
+
+
+def test_budget_exhausted_after_wait_seconds(store_path):
+    governor = ConnectionGovernor(SQLiteLeaseStore(store_path, ttl=30), 1, wait_seconds=0.3, backoff_seconds=0.01)
+    with governor.lease():
+        start = time.monotonic()
+        with pytest.raises(ConnectionBudgetExhausted):
+            with governor.lease():
+                pass
+        assert 0.3 <= time.monotonic() - start < 1.5
+
+
+def test_zero_budget_is_passthrough():
+    governor = ConnectionGovernor(None, 0)
+    with governor.lease() as lease_id:
+        with governor.lease() as other_lease_id:
+            assert lease_id is None and other_lease_id is None
+
+
+def fake_extract_names(engine, ids_str):
+    return [{"id": 1, "name": "Alice", "date": "2025-01-01"}, {"id": 2, "name": "Bob", "date": "2025-01-01"}]
+
+
+def test_fetch_names_serves_from_name_cache_when_budget_exhausted(store_path):
+    governor = ConnectionGovernor(SQLiteLeaseStore(store_path, ttl=30), 1, wait_seconds=0)
+    name_cache = NameCache()
+    disconnected = []
+    result = fetch_names(governor, name_cache, lambda: "engine", disconnected.append, fake_extract_names, "(1, 2)")
+    assert [r["name"] for r in result] == ["Alice", "Bob"]
+    assert disconnected == ["engine"]
+
+    with governor.lease():
+        cached = fetch_names(governor, name_cache, pytest.fail, disconnected.append, fake_extract_names, "(2, 1)")
+    assert [(r["id"], r["name"]) for r in cached] == [(1, "Alice"), (2, "Bob")]
+
+
+def test_fetch_names_raises_on_cache_miss_when_budget_exhausted(store_path):
+    governor = ConnectionGovernor(SQLiteLeaseStore(store_path, ttl=30), 1, wait_seconds=0)
+    name_cache = NameCache()
+    name_cache.update(fake_extract_names(None, "(1, 2)"))
+    with governor.lease():
+        with pytest.raises(ConnectionBudgetExhausted, match="name cache"):
+            fetch_names(governor, name_cache, pytest.fail, pytest.fail, fake_extract_names, "(1, 3)")
+
+
+def test_fetch_names_disconnects_when_extract_raises(store_path):
+    governor = ConnectionGovernor(SQLiteLeaseStore(store_path, ttl=30), 1, wait_seconds=0)
+    disconnected = []
+
+    def failing_extract(engine, ids_str):
+        raise RuntimeError("lost connection")
+
+    with pytest.raises(RuntimeError):
+        fetch_names(governor, NameCache(), lambda: "engine", disconnected.append, failing_extract, "(1)")
+    assert disconnected == ["engine"]
+    assert governor.store.active() == 0
+
+
+def test_governor_from_env_requires_shared_store(monkeypatch, store_path):
+    monkeypatch.setenv("DB_CONNECTION_BUDGET", "5")
+    monkeypatch.delenv("LEASE_STORE_URL", raising=False)
+    with pytest.raises(ValueError):
+        governor_from_env()
+
+    monkeypatch.setenv("LEASE_STORE_URL", f"sqlite:///{store_path}")
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_NAME", "superstore")
+    with pytest.raises(ValueError):
+        governor_from_env()
+
+    monkeypatch.delenv("AWS_LAMBDA_FUNCTION_NAME")
+    assert governor_from_env().budget == 5
+
+
+@pytest.fixture
+def redis_server():
+    # RedisLeaseStore is the production store; fakeredis runs its Lua script, zadd & zcount in process
+    fakeredis = pytest.importorskip("fakeredis")
+    return fakeredis.FakeServer()
+
+
+def redis_store(server, ttl):
+    import fakeredis
+    return RedisLeaseStore(None, ttl, client=fakeredis.FakeRedis(server=server))
+
+
+def test_redis_budget_is_never_exceeded_across_threads(redis_server):
+    intervals = []
+    lock = threading.Lock()
+
+    def handler():
+        # One client & governor per handler, like separate Lambda containers
+        governor = ConnectionGovernor(redis_store(redis_server, ttl=30), 3, wait_seconds=30, backoff_seconds=0.01)
+        with governor.lease():
+            start = time.time()
+            time.sleep(0.05)
+            end = time.time()
+        with lock:
+            intervals.append((start, end))
+
+    threads = [threading.Thread(target=handler) for _ in range(30)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(intervals) == 30
+    assert max_overlap(intervals) == 3
+    assert redis_store(redis_server, ttl=30).active() == 0
+
+
+def test_redis_expired_leases_are_reclaimed(redis_server):
+    store = redis_store(redis_server, ttl=0.1)
+    assert store.try_acquire(1) is not None
+    assert store.try_acquire(1) is None
+    assert store.active() == 1
+    time.sleep(0.2)
+    assert store.active() == 0
+    assert store.try_acquire(1) is not None
+
+
+def test_redis_held_lease_is_renewed_past_ttl(redis_server):
+    governor = ConnectionGovernor(redis_store(redis_server, ttl=0.3), 1, wait_seconds=0)
+    with governor.lease():
+        time.sleep(0.6)
+        assert governor.store.try_acquire(1) is None
+    assert governor.store.active() == 0
+
+
+def test_redis_renew_does_not_re_add_a_reclaimed_lease(redis_server):
+    store = redis_store(redis_server, ttl=0.1)
+    lease_id = store.try_acquire(1)
+    assert store.renew(lease_id)
+    time.sleep(0.2)
+    assert store.try_acquire(1) is not None
+    assert not store.renew(lease_id)
+    assert store.active() == 1
+
+
+def test_redis_outage_falls_back_to_name_cache(redis_server):
+    governor = ConnectionGovernor(redis_store(redis_server, ttl=30), 1, wait_seconds=0.2, backoff_seconds=0.01)
+    name_cache = NameCache()
+    fetch_names(governor, name_cache, lambda: "engine", lambda engine: None, fake_extract_names, "(1, 2)")
+
+    redis_server.connected = False
+    assert governor.store.try_acquire(1) is None
+    cached = fetch_names(governor, name_cache, pytest.fail, pytest.fail, fake_extract_names, "(1, 2)")
+    assert [r["name"] for r in cached] == ["Alice", "Bob"]
+    with pytest.raises(ConnectionBudgetExhausted):
+        fetch_names(governor, name_cache, pytest.fail, pytest.fail, fake_extract_names, "(3)")
+
+
+def test_redis_store_uses_short_timeouts_and_survives_unreachable_redis():
+    pytest.importorskip("redis")
+    # Port 1 is closed, like an ElastiCache endpoint behind a wrong security group
+    store = RedisLeaseStore("redis://127.0.0.1:1/0", 30, timeout=0.2)
+    connection_kwargs = store.client.connection_pool.connection_kwargs
+    assert connection_kwargs["socket_timeout"] == 0.2
+    assert connection_kwargs["socket_connect_timeout"] == 0.2
+    start = time.monotonic()
+    assert store.try_acquire(1) is None
+    assert time.monotonic() - start < 1